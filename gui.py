@@ -1,59 +1,130 @@
 import os
+import logging
+import sys
 import datetime
 import subprocess
 import threading
+import time
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor, wait
 import sounddevice as sd
-from pydub import AudioSegment
+import soundfile as sf
 import json
 import PySimpleGUI as sg
 from utils import (
+    WAV_FOLDER,
+    SESSIONS_FOLDER,
+    STRIP_SEPARATORS,
     load_all_question_sets,
     transcribe_audio_file,
+    transcribe_audio_files,
+    clear_transcript_cache,
+    warm_up_transcriber,
     generate_docx_report
 )
 
-# Globals for recording
-recorder_stream = None
-recorder_chunks = []
-recorder_lock = threading.Lock()
-
-def start_recording():
-    """Begin capturing microphone audio in recorder_chunks."""
-    global recorder_stream, recorder_chunks
-    recorder_chunks = []
-    fs = 16000
-    def callback(indata, frames, time, status):
-        if status:
-            print(status)
-        with recorder_lock:
-            recorder_chunks.append(indata.copy())
-    recorder_stream = sd.InputStream(samplerate=fs, channels=1, callback=callback)
-    recorder_stream.start()
-
-
-def stop_recording_and_save(session_id, question_id):
-    """Stop capture, save WAV, return path."""
-    global recorder_stream, recorder_chunks
-    recorder_stream.stop()
-    recorder_stream.close()
-    data = np.concatenate(recorder_chunks, axis=0)
-    # convert to int16 PCM
-    audio_int16 = (data * 32767).astype(np.int16)
-    wav_folder = os.path.join(os.path.dirname(__file__), "data", "audio")
-    os.makedirs(wav_folder, exist_ok=True)
-    safe_session = session_id.replace(':', '').replace('-', '')
+log = logging.getLogger(__name__)
+
+# Globals for recording. A dedicated thread pulls blocks with a blocking
+# InputStream.read(), which waits in C with the GIL released, and writes them
+# straight to the WAV file; no Python runs on the real-time audio thread.
+SAMPLE_RATE = 16000
+BLOCK_SIZE = 1024
+recorder_thread = None
+recorder_stop = threading.Event()
+recorder_sf = None
+recorder_path = None
+recorder_blocks = []
+recorder_errors = []
+recorder_stats = {'overflows': 0}
+
+# Transcription runs off the GUI thread; results come back as -TRANSCRIPT_READY- events.
+# Vosk decodes outside the GIL, so several queued recordings can be transcribed
+# at once while the clinician moves on to the next question.
+TRANSCRIBE_WORKERS = max(1, min(4, (os.cpu_count() or 2) // 2))
+EXECUTOR = ThreadPoolExecutor(max_workers=TRANSCRIBE_WORKERS, thread_name_prefix='transcribe')
+# Outstanding jobs: future -> (subcat, index, wav path). Touched only on the GUI thread.
+pending_transcripts = {}
+# Cleared before the session window closes so late jobs stop posting events to it
+session_window_open = threading.Event()
+
+def start_recording(session_id, question_id):
+    """Begin capturing microphone audio into a new WAV file under data/audio/."""
+    global recorder_thread, recorder_sf, recorder_path, recorder_blocks
+    safe_session = session_id.translate(STRIP_SEPARATORS)
     ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     fname = f"session_{safe_session}_q_{question_id}_{ts}.wav"
-    path = os.path.join(wav_folder, fname)
-    seg = AudioSegment(
-        audio_int16.tobytes(),
-        frame_rate=16000,
-        sample_width=2,
-        channels=1
+    recorder_path = os.path.join(WAV_FOLDER, fname)
+    # Open the device here on the GUI thread so a missing or busy microphone
+    # raises to the caller instead of silently killing the capture thread.
+    # Capture 16-bit PCM natively: no float buffers, and blocks go to the WAV
+    # and the recognizer without any scaling.
+    stream = sd.InputStream(
+        samplerate=SAMPLE_RATE, channels=1, dtype='int16', blocksize=BLOCK_SIZE
     )
-    seg.export(path, format='wav')
-    return path
+    try:
+        stream.start()
+        recorder_sf = sf.SoundFile(
+            recorder_path, mode='w', samplerate=SAMPLE_RATE, channels=1, subtype='PCM_16'
+        )
+    except Exception:
+        stream.close()
+        raise
+    recorder_blocks = []
+    recorder_errors.clear()
+    recorder_stop.clear()
+    recorder_thread = threading.Thread(
+        target=_capture_loop, args=(stream, recorder_sf, recorder_blocks), daemon=True
+    )
+    recorder_thread.start()
+
+
+def _capture_loop(stream, out_sf, blocks):
+    overflows = 0
+    try:
+        while not recorder_stop.is_set():
+            data, overflowed = stream.read(BLOCK_SIZE)
+            overflows += overflowed
+            out_sf.write(data)
+            blocks.append(data)  # read() returns a fresh array per call
+    except Exception as e:
+        # Handed to stop_recording_and_save, which re-raises on the GUI thread
+        recorder_errors.append(e)
+    finally:
+        stream.stop()
+        stream.close()
+    # Reported once the take ends, never from inside the read loop
+    recorder_stats['overflows'] += overflows
+    if overflows:
+        log.warning("Input overflowed %d times while recording %s", overflows, out_sf.name)
+
+
+def stop_recording_and_save():
+    """
+    Stop capture and finalize the WAV. Returns (path, samples); the in-memory
+    samples let the transcriber skip reading the archive copy back from disk.
+    Re-raises any error the capture thread hit while reading the device.
+    """
+    recorder_stop.set()
+    recorder_thread.join()
+    recorder_sf.close()
+    if recorder_errors:
+        raise recorder_errors[0]
+    if recorder_blocks:
+        samples = np.concatenate(recorder_blocks)
+    else:
+        samples = np.zeros((0, 1), dtype=np.int16)
+    return recorder_path, samples
+
+
+def play_audio(path):
+    """Open a recording in the system's default player without going through a shell."""
+    if sys.platform == 'win32':
+        os.startfile(path)
+    elif sys.platform == 'darwin':
+        subprocess.Popen(['open', path])
+    else:
+        subprocess.Popen(['xdg-open', path])
 
 
 def transform_question_sets(raw_sets):
@@ -62,19 +133,17 @@ def transform_question_sets(raw_sets):
     for subcat, qlist in undefined.items():
         for q in qlist:
             id_map[q['id']] = q['text']
-    final = {}
-    for category, subcats in raw_sets.items():
-        mapped = {}
-        for subcat, items in subcats.items():
-            qobjs = []
-            if items and isinstance(items[0], int):
-                for qid in items:
-                    qobjs.append({'id': qid, 'text': id_map.get(qid, f"(missing {qid})")})
-            else:
-                for q in items:
-                    qobjs.append(q)
-            mapped[subcat] = qobjs
-        final[category] = mapped
+    final = {
+        category: {
+            subcat: (
+                [{'id': qid, 'text': id_map.get(qid, f"(missing {qid})")} for qid in items]
+                if items and isinstance(items[0], int)
+                else items
+            )
+            for subcat, items in subcats.items()
+        }
+        for category, subcats in raw_sets.items()
+    }
     return final
 
 # Load and prepare question sets
@@ -83,6 +152,14 @@ question_sets = transform_question_sets(raw_sets)
 
 temporary_session_data = {}
 
+# Append-only JSONL journal of the running session, so a crash does not lose it.
+# Records: 'session' (header), 'slot', 'note', and a closing 'end'.
+session_log = None
+
+# Set when a slot's widgets diverge from the stored slot; lets commit_current_slot
+# skip the Tk round-trip and journal write on plain navigation.
+slot_dirty = {'-TRANSCRIPT-': False, '-TYPED-': False}
+
 
 def session_setup_window():
     categories = list(question_sets.keys())
@@ -114,14 +191,16 @@ def session_setup_window():
             return name, dob, cat
 
 
-def initialize_session(name, dob, category):
+def initialize_session(name, dob, category, started=None):
     global temporary_session_data
-    started = datetime.datetime.now().isoformat(timespec="seconds")
+    resuming = started is not None
+    if not resuming:
+        started = datetime.datetime.now().isoformat(timespec="seconds")
     raw_subcats = question_sets[category]
     slots_by_subcat = {}
     for subcat, qlist in raw_subcats.items():
         slots_by_subcat[subcat] = [
-            {'question_id': q['id'], 'question_text': q['text'], 'transcript': '', 'typed_answer': '', 'audio_path': ''}
+            {'question_id': q['id'], 'question_text': q['text'], 'transcript': '', 'typed_answer': '', 'audio_path': '', 'transcribed': False}
             for q in qlist
         ]
     temporary_session_data = {
@@ -134,6 +213,118 @@ def initialize_session(name, dob, category):
         'current_index': 0,
         'general_notes': []
     }
+    open_session_log(started)
+    if not resuming:
+        log_session_event({
+            'type': 'session',
+            'patient_name': name,
+            'patient_dob': dob,
+            'diagnostic_category': category,
+            'started_at': started
+        })
+
+
+def open_session_log(started):
+    global session_log
+    safe_session = started.translate(STRIP_SEPARATORS)
+    path = os.path.join(SESSIONS_FOLDER, f"{safe_session}.jsonl")
+    session_log = open(path, 'a', encoding='utf-8', buffering=1)
+    if session_log.tell() > 0:
+        with open(path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                session_log.write('\n')  # start clear of a torn line left by a crash
+
+
+def log_session_event(record):
+    session_log.write(json.dumps(record) + '\n')
+
+
+def log_slot(sc, idx):
+    slot = temporary_session_data['questions_by_subcat'][sc][idx]
+    log_session_event({
+        'type': 'slot',
+        'subcat': sc,
+        'index': idx,
+        'question_id': slot['question_id'],
+        'transcript': slot['transcript'],
+        'typed_answer': slot['typed_answer'],
+        'audio_path': slot['audio_path'],
+        'transcribed': slot['transcribed']
+    })
+
+
+def close_session_log(status):
+    log_session_event({'type': 'end', 'status': status})
+    session_log.close()
+    remove_session_log(session_log.name)
+
+
+def remove_session_log(path):
+    """
+    Delete a journal once its session is over, together with the transcript
+    cache; both hold patient details and transcripts. If removal fails, the
+    journal's 'end' record still keeps it from being offered for recovery.
+    """
+    try:
+        os.remove(path)
+    except OSError as e:
+        log.warning("Could not remove session journal %s: %s", path, e)
+    clear_transcript_cache()
+
+
+def read_session_log(path):
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue  # torn line from a crash
+    return records
+
+
+def find_unfinished_session():
+    """Return (path, records) for the newest journal without an 'end' record, else (None, None)."""
+    with os.scandir(SESSIONS_FOLDER) as it:
+        logs = [e for e in it if e.is_file() and e.name.endswith('.jsonl')]
+    for entry in sorted(logs, key=lambda e: e.stat().st_mtime, reverse=True):
+        records = read_session_log(entry.path)
+        if not records or records[0].get('type') != 'session':
+            continue
+        if records[-1].get('type') == 'end':
+            continue
+        if records[0]['diagnostic_category'] not in question_sets:
+            continue
+        return entry.path, records
+    return None, None
+
+
+def resume_session(records):
+    """Rebuild temporary_session_data from a journal and keep appending to it."""
+    head = records[0]
+    initialize_session(
+        head['patient_name'], head['patient_dob'], head['diagnostic_category'], head['started_at']
+    )
+    sess = temporary_session_data
+    for rec in records[1:]:
+        if rec['type'] == 'slot':
+            slots = sess['questions_by_subcat'].get(rec['subcat'])
+            if slots is None or rec['index'] >= len(slots):
+                continue
+            slot = slots[rec['index']]
+            # The question set may have been edited since the crash; never
+            # attach an answer to a different question than it was given for
+            if slot['question_id'] != rec['question_id']:
+                continue
+            slot['transcript'] = rec['transcript']
+            slot['typed_answer'] = rec['typed_answer']
+            slot['audio_path'] = rec['audio_path']
+            slot['transcribed'] = rec.get('transcribed', bool(rec['transcript']))
+            sess['current_subcat'] = rec['subcat']
+            sess['current_index'] = rec['index']
+        elif rec['type'] == 'note':
+            sess['general_notes'].append(rec['note'])
 
 
 def commit_current_slot(window):
@@ -141,8 +332,14 @@ def commit_current_slot(window):
     sc = sess['current_subcat']
     idx = sess['current_index']
     slot = sess['questions_by_subcat'][sc][idx]
-    slot['transcript'] = window['-TRANSCRIPT-'].get().rstrip()
-    slot['typed_answer'] = window['-TYPED-'].get().strip()
+    if not (slot_dirty['-TRANSCRIPT-'] or slot_dirty['-TYPED-']):
+        return
+    if slot_dirty['-TRANSCRIPT-']:
+        slot['transcript'] = window['-TRANSCRIPT-'].get().rstrip()
+    if slot_dirty['-TYPED-']:
+        slot['typed_answer'] = window['-TYPED-'].get().strip()
+    slot_dirty['-TRANSCRIPT-'] = slot_dirty['-TYPED-'] = False
+    log_slot(sc, idx)
 
 
 def get_slot():
@@ -152,6 +349,55 @@ def get_slot():
     return sess['questions_by_subcat'][sc][idx]
 
 
+def append_transcript(existing, new_t):
+    existing = existing.rstrip()
+    return existing + ('\n' if existing else '') + new_t
+
+
+def apply_transcript(sc, idx, wav, new_t):
+    """Append a finished transcript to a slot that is not on screen."""
+    slot = temporary_session_data['questions_by_subcat'][sc][idx]
+    slot['transcript'] = append_transcript(slot['transcript'], new_t)
+    # An empty transcript (silence) still counts; only a newer take resets this
+    if wav == slot['audio_path']:
+        slot['transcribed'] = True
+    log_slot(sc, idx)
+
+
+def _post_transcript(window, fut):
+    if session_window_open.is_set():
+        window.write_event_value('-TRANSCRIPT_READY-', fut)
+
+
+def untranscribed_recordings():
+    return [
+        (sc, idx, slot['audio_path'])
+        for sc, slots in temporary_session_data['questions_by_subcat'].items()
+        for idx, slot in enumerate(slots)
+        if slot['audio_path'] and not slot['transcribed'] and os.path.exists(slot['audio_path'])
+    ]
+
+
+def finish_transcriptions():
+    """
+    Collect background jobs still running when the session window closed, then
+    transcribe any recording that never got a transcript (e.g. a resumed session).
+    """
+    for fut, (sc, idx, wav) in list(pending_transcripts.items()):
+        try:
+            new_t = fut.result()
+        except Exception as e:
+            log.warning("Transcription of %s failed: %s", wav, e)
+            continue
+        apply_transcript(sc, idx, wav, new_t)
+    pending_transcripts.clear()
+    missing = untranscribed_recordings()
+    if missing:
+        transcripts = transcribe_audio_files([wav for _, _, wav in missing])
+        for sc, idx, wav in missing:
+            apply_transcript(sc, idx, wav, transcripts[wav])
+
+
 def question_window():
     sess = temporary_session_data
     subcats = list(sess['questions_by_subcat'].keys())
@@ -161,6 +407,7 @@ def question_window():
         window['-QUESTION_TEXT-'].update(slot['question_text'])
         window['-TRANSCRIPT-'].update(slot['transcript'])
         window['-TYPED-'].update(slot['typed_answer'])
+        slot_dirty['-TRANSCRIPT-'] = slot_dirty['-TYPED-'] = False
         sc = sess['current_subcat']
         sec_total = len(sess['questions_by_subcat'][sc])
         sec_idx = sess['current_index'] + 1
@@ -176,50 +423,87 @@ def question_window():
         [sg.Text('Section:'), sg.Combo(subcats, default_value=sess['current_subcat'], key='-SUBCAT-', enable_events=True)],
         [sg.Text('', key='-SECTION_PROG-', size=(20,1)), sg.Text('', key='-TOTAL_PROG-', size=(20,1))],
         [sg.Text('', key='-QUESTION_TEXT-', size=(60,3), font=('Arial',12))],
-        [sg.Button('Start Recording', key='-START_REC-'), sg.Button('Stop Recording', key='-STOP_REC-', disabled=True), sg.Button('Play Audio', key='-PLAY-')],
-        [sg.Multiline('', size=(60,6), key='-TRANSCRIPT-', disabled=True)],
+        [sg.Button('Start Recording', key='-START_REC-'), sg.Button('Stop Recording', key='-STOP_REC-', disabled=True), sg.Button('Play Audio', key='-PLAY-'), sg.Text('Transcribing…', key='-TRANSCRIBING-', visible=False)],
+        [sg.Multiline('', size=(60,6), key='-TRANSCRIPT-', disabled=True, enable_events=True)],
         [sg.Text('Typed Answer / Notes:')],
-        [sg.Multiline('', size=(60,4), key='-TYPED-')],
+        [sg.Multiline('', size=(60,4), key='-TYPED-', enable_events=True)],
         [sg.Button('Previous', key='-PREV-'), sg.Button('Next', key='-NEXT-')],
         [sg.Button('General Notes', key='-GENERAL_NOTES-'), sg.Button('Finish & Generate Report', key='-FINISH-')]
     ]
 
     window = sg.Window('Consultation Session', layout, finalize=True, resizable=True, size=(800,700))
     refresh_ui(window)
+    session_window_open.set()
 
     while True:
-        event, vals = window.read(timeout=100)
+        event, vals = window.read()
         if event in (sg.WIN_CLOSED,):
             if sg.popup_yes_no('Exit session? All data will be lost.') == 'Yes':
+                session_window_open.clear()
                 window.close()
                 return 'CANCEL'
             continue
 
-        if event == '-SUBCAT-':
+        if event in slot_dirty:
+            slot_dirty[event] = True
+
+        elif event == '-SUBCAT-':
             commit_current_slot(window)
             sess['current_subcat'] = vals['-SUBCAT-']
             sess['current_index'] = 0
             refresh_ui(window)
 
         elif event == '-START_REC-':
-            start_recording()
+            recording_pos = (sess['current_subcat'], sess['current_index'])
+            try:
+                start_recording(sess['started_at'], get_slot()['question_id'])
+            except sd.PortAudioError as e:
+                sg.popup(f'Could not start recording: {e}')
+                continue
             window['-START_REC-'].update(disabled=True)
             window['-STOP_REC-'].update(disabled=False)
 
         elif event == '-STOP_REC-':
-            wav = stop_recording_and_save(sess['started_at'], get_slot()['question_id'])
-            get_slot()['audio_path'] = wav
-            new_t = transcribe_audio_file(wav)
-            existing = window['-TRANSCRIPT-'].get().rstrip()
-            combined = existing + ('\n' if existing else '') + new_t
-            window['-TRANSCRIPT-'].update(combined)
             window['-START_REC-'].update(disabled=False)
             window['-STOP_REC-'].update(disabled=True)
+            try:
+                wav, samples = stop_recording_and_save()
+            except Exception as e:
+                sg.popup(f'Recording failed: {e}')
+                continue
+            sc, idx = recording_pos
+            slot = sess['questions_by_subcat'][sc][idx]
+            slot['audio_path'] = wav
+            slot['transcribed'] = False
+            log_slot(sc, idx)
+            fut = EXECUTOR.submit(transcribe_audio_file, samples, SAMPLE_RATE)
+            pending_transcripts[fut] = (sc, idx, wav)
+            fut.add_done_callback(lambda f: _post_transcript(window, f))
+            window['-TRANSCRIBING-'].update(visible=True)
+
+        elif event == '-TRANSCRIPT_READY-':
+            fut = vals['-TRANSCRIPT_READY-']
+            sc, idx, wav = pending_transcripts.pop(fut)
+            window['-TRANSCRIBING-'].update(visible=bool(pending_transcripts))
+            try:
+                new_t = fut.result()
+            except Exception as e:
+                sg.popup(f'Transcription failed: {e}')
+                continue
+            # The user may have moved on to another question while this ran
+            if (sc, idx) == (sess['current_subcat'], sess['current_index']):
+                window['-TRANSCRIPT-'].update(append_transcript(window['-TRANSCRIPT-'].get(), new_t))
+                if wav == get_slot()['audio_path']:
+                    get_slot()['transcribed'] = True
+                slot_dirty['-TRANSCRIPT-'] = True
+                commit_current_slot(window)
+            else:
+                apply_transcript(sc, idx, wav, new_t)
 
         elif event == '-PLAY-':
             path = get_slot()['audio_path']
             if path and os.path.exists(path):
-                subprocess.Popen(['cmd.exe','/C', f'start "" "{path}"'])
+                play_audio(path)
             else:
                 sg.popup('No recording found.')
 
@@ -256,8 +540,9 @@ def question_window():
                 if ne == '-SAVE_NOTE-':
                     txt = nv['-NOTE_TEXT-'].strip()
                     if txt:
-                        ts = datetime.datetime.now().isoformat(timespec='seconds')
-                        sess['general_notes'].append(f"{txt} (noted at {ts})")
+                        note = {'text': txt, 'noted_at_ns': time.time_ns()}
+                        sess['general_notes'].append(note)
+                        log_session_event({'type': 'note', 'note': note})
                         sg.popup('Note saved.')
                     else:
                         sg.popup('Note is empty.')
@@ -265,6 +550,7 @@ def question_window():
         elif event == '-FINISH-':
             if sg.popup_yes_no('Finish session and generate report?') == 'Yes':
                 commit_current_slot(window)
+                session_window_open.clear()
                 window.close()
                 return 'FINISH'
 
@@ -272,14 +558,41 @@ def question_window():
 
 
 def run_app():
-    name, dob, cat = session_setup_window()
-    if not name:
-        return
-    initialize_session(name, dob, cat)
+    # Hide recognizer cold-start behind session setup
+    threading.Thread(target=warm_up_transcriber, daemon=True).start()
+    log_path, records = find_unfinished_session()
+    if records and sg.popup_yes_no(
+        f"Resume the unfinished session for {records[0]['patient_name']} "
+        f"(started {records[0]['started_at']})?"
+    ) == 'Yes':
+        resume_session(records)
+    else:
+        if records:
+            with open(log_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'type': 'end', 'status': 'discarded'}) + '\n')
+            remove_session_log(log_path)
+        name, dob, cat = session_setup_window()
+        if not name:
+            return
+        initialize_session(name, dob, cat)
     res = question_window()
     if res == 'CANCEL':
+        for fut in pending_transcripts:
+            fut.cancel()
+        # Jobs already running would write to the transcript cache after it is cleared
+        wait(pending_transcripts)
+        pending_transcripts.clear()
+        close_session_log('cancelled')
         sg.popup('Session cancelled.')
         return
+    if pending_transcripts or untranscribed_recordings():
+        # The session window is already gone; show that the app is still working
+        wait_win = sg.Window(
+            'Please wait', [[sg.Text('Finishing transcriptions…')]], finalize=True, modal=True
+        )
+        wait_win.refresh()
+        finish_transcriptions()
+        wait_win.close()
     sess = temporary_session_data
     flat = []
     for sub in sess['questions_by_subcat'].values():
@@ -293,6 +606,7 @@ def run_app():
         'general_notes': sess['general_notes']
     }
     path = generate_docx_report(report_data)
+    close_session_log('finished')
     sg.popup(f"Report generated successfully:\n{path}")
 
 if __name__ == '__main__':
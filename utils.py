@@ -1,14 +1,67 @@
 import os
-import json
+import logging
 import datetime
 import wave
+import hashlib
+import functools
+import tempfile
+import pickle
+import io
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+try:
+    import orjson
+except ImportError:  # stdlib json also accepts bytes/str in loads()
+    import json as orjson
 from vosk import Model as VoskModel, KaldiRecognizer
 from docx import Document
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
+from xml.sax.saxutils import escape
 
-# Initialize Vosk model for fast offline transcription
-VOSK_MODEL = VoskModel(
-    os.path.join(os.path.dirname(__file__), "data", "models", "vosk-model-small-en-us-0.15")
-)
+log = logging.getLogger(__name__)
+
+_BASE = os.path.dirname(__file__)
+
+# Data locations and report template, resolved once at import
+QUESTIONS_FOLDER = os.path.join(_BASE, 'data', 'questions')
+WAV_FOLDER = os.path.join(_BASE, 'data', 'audio')
+REPORTS_FOLDER = os.path.join(_BASE, 'reports')
+SESSIONS_FOLDER = os.path.join(_BASE, 'data', 'sessions')
+TEMPLATE_PATH = os.path.join(_BASE, 'templates', 'report_template.docx')
+_TEMPLATE_EXISTS = os.path.isfile(TEMPLATE_PATH)
+_TEMPLATE_BYTES = None  # template file contents, read on the first report
+os.makedirs(WAV_FOLDER, exist_ok=True)
+os.makedirs(REPORTS_FOLDER, exist_ok=True)
+os.makedirs(SESSIONS_FOLDER, exist_ok=True)
+
+# Drops ':' and '-' from ISO timestamps in one pass when building file names
+STRIP_SEPARATORS = str.maketrans('', '', ':-')
+# Characters python-docx turns into run elements rather than text
+_RUN_BREAKS = re.compile(r'([\t\n\r])')
+
+# Vosk model for fast offline transcription, loaded on first use
+VOSK_MODEL_PATH = os.path.join(_BASE, "data", "models", "vosk-model-small-en-us-0.15")
+_VOSK_MODEL = None
+_VOSK_MODEL_LOCK = threading.Lock()
+# Frames handed to AcceptWaveform per call (1 s at 16 kHz)
+FRAMES_PER_CHUNK = 16000
+
+# On-disk transcript cache, keyed by the SHA-256 of the WAV bytes. It holds
+# patient speech as text, so it only lives as long as a session: the app calls
+# clear_transcript_cache() whenever a session ends
+TRANSCRIPT_CACHE_FOLDER = os.path.join(_BASE, "data", "cache", "transcripts")
+TRANSCRIPT_CACHE_MAX_BYTES = 50 * 1024 * 1024
+transcript_cache_stats = {'cache_hit': 0, 'cache_miss': 0}
+_transcript_cache_bytes = None  # running size of the cache, counted on the first write
+_TRANSCRIPT_CACHE_LOCK = threading.Lock()
+
+# Parsed question sets are pickled next to the JSON they were built from
+QUESTION_CACHE_NAME = '.cache.pkl'
+# ...and memoized in-process for repeat calls while the files are unchanged
+_QSET_CACHE = {}
 
 def load_all_question_sets():
     """
@@ -18,51 +71,320 @@ def load_all_question_sets():
       - A single combined JSON: category -> subcategory -> [ ... ]
       - Legacy per-category file with {diagnostic_category, questions: [...]}
     """
-    folder = os.path.join(os.path.dirname(__file__), "data", "questions")
+    folder = QUESTIONS_FOLDER
+    sig = _question_sets_signature(folder)
+    if _QSET_CACHE.get('sig') == sig:
+        return _QSET_CACHE['question_sets']
+    question_sets = _load_pickled_question_sets(folder, sig)
+    _QSET_CACHE['sig'] = sig
+    _QSET_CACHE['question_sets'] = question_sets
+    return question_sets
+
+
+def _load_pickled_question_sets(folder, sig):
+    cache_path = os.path.join(folder, QUESTION_CACHE_NAME)
+    try:
+        with open(cache_path, 'rb') as f:
+            cached = pickle.load(f)
+        if cached['sig'] == sig:
+            return cached['question_sets']
+    except (OSError, EOFError, KeyError, TypeError, pickle.UnpicklingError):
+        pass
+
+    question_sets = _read_question_sets(folder)
+    # Best effort: the questions folder only has to be readable
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump({'sig': sig, 'question_sets': question_sets}, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        log.warning("Could not write question set cache %s: %s", cache_path, e)
+        if tmp_path is not None:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+    return question_sets
+
+
+def _question_files(folder):
+    with os.scandir(folder) as it:
+        return [
+            entry for entry in it
+            if entry.is_file() and entry.name.lower().endswith('.json')
+        ]
+
+
+def _question_sets_signature(folder):
+    """Names, mtimes and sizes of the JSON files, used to invalidate the pickled cache."""
+    sig = []
+    for entry in _question_files(folder):
+        st = entry.stat()
+        # Size catches a copy that kept the old timestamp (cp -p, unzip)
+        sig.append((entry.name, st.st_mtime, st.st_size))
+    return tuple(sorted(sig))
+
+
+def _load_json(path):
+    with open(path, 'rb') as f:
+        return orjson.loads(f.read())
+
+
+def _read_question_sets(folder):
+    paths = [entry.path for entry in _question_files(folder)]
+    # File reads release the GIL, so small files load concurrently
+    with ThreadPoolExecutor(max_workers=8) as ex:
+        datas = list(ex.map(_load_json, paths))
+
     question_sets = {}
-    for fname in os.listdir(folder):
-        if not fname.lower().endswith('.json'):
-            continue
-        path = os.path.join(folder, fname)
-        with open(path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            # Case A: combined file format
-            if isinstance(data, dict):
-                first_val = next(iter(data.values()), None)
-                if isinstance(first_val, dict):
-                    for category, subs in data.items():
-                        question_sets[category] = subs
-                    continue
-            # Case B: legacy per-file format
-            category = data.get('diagnostic_category')
-            questions = data.get('questions', [])
-            if category:
-                question_sets[category] = {"All": questions}
+    for data in datas:
+        # Case A: combined file format
+        if isinstance(data, dict):
+            first_val = next(iter(data.values()), None)
+            if isinstance(first_val, dict):
+                for category, subs in data.items():
+                    question_sets[category] = subs
+                continue
+        # Case B: legacy per-file format
+        category = data.get('diagnostic_category')
+        questions = data.get('questions', [])
+        if category:
+            question_sets[category] = {"All": questions}
     return question_sets
 
 
-def transcribe_audio_file(wav_path):
+def _get_vosk_model():
+    """Load the Vosk model on first use; double-checked so concurrent callers load it once."""
+    global _VOSK_MODEL
+    if _VOSK_MODEL is None:
+        with _VOSK_MODEL_LOCK:
+            if _VOSK_MODEL is None:
+                _VOSK_MODEL = VoskModel(VOSK_MODEL_PATH)
+    return _VOSK_MODEL
+
+
+def _hash_audio(source, sample_rate):
+    h = hashlib.sha256()
+    if isinstance(source, np.ndarray):
+        # Raw samples carry no header, so the rate has to be part of the key
+        h.update(f"{source.dtype.str}:{sample_rate}:".encode())
+        h.update(np.ascontiguousarray(source).data)
+        return h.hexdigest()
+    with open(source, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+@functools.lru_cache(maxsize=256)
+def _read_cached_transcript(digest):
+    """
+    L1 (in-memory) over L2 (disk) lookup. Raises FileNotFoundError on a miss,
+    which lru_cache does not memoize, so later writes are picked up.
+    """
+    path = os.path.join(TRANSCRIPT_CACHE_FOLDER, f"{digest}.txt")
+    with open(path, 'r', encoding='utf-8') as f:
+        transcript = f.read()
+    os.utime(path)  # refresh mtime so eviction is least-recently-used
+    return transcript
+
+
+def _write_cached_transcript(digest, transcript):
+    global _transcript_cache_bytes
+    os.makedirs(TRANSCRIPT_CACHE_FOLDER, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=TRANSCRIPT_CACHE_FOLDER, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(transcript)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, os.path.join(TRANSCRIPT_CACHE_FOLDER, f"{digest}.txt"))
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    with _TRANSCRIPT_CACHE_LOCK:
+        if _transcript_cache_bytes is None:
+            _transcript_cache_bytes = _evict_cached_transcripts()
+        else:
+            _transcript_cache_bytes += size
+            # Only walk the folder once the running total crosses the budget
+            if _transcript_cache_bytes > TRANSCRIPT_CACHE_MAX_BYTES:
+                _transcript_cache_bytes = _evict_cached_transcripts()
+
+
+def _evict_cached_transcripts():
+    """
+    Delete the oldest cached transcripts until the folder fits the byte budget.
+    Returns the bytes left in the cache.
+    """
+    entries = []
+    total = 0
+    with os.scandir(TRANSCRIPT_CACHE_FOLDER) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.endswith('.txt'):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+    entries.sort()
+    for _, size, path in entries:
+        if total <= TRANSCRIPT_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    return total
+
+
+def clear_transcript_cache():
+    """Delete every cached transcript, on disk and in memory."""
+    global _transcript_cache_bytes
+    with _TRANSCRIPT_CACHE_LOCK:
+        _read_cached_transcript.cache_clear()
+        try:
+            with os.scandir(TRANSCRIPT_CACHE_FOLDER) as it:
+                paths = [entry.path for entry in it if entry.is_file()]
+        except FileNotFoundError:
+            paths = []
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError as e:
+                log.warning("Could not remove cached transcript %s: %s", path, e)
+        _transcript_cache_bytes = None
+
+
+def cache_transcripts(func):
+    """
+    Decorator for transcribe_audio_file: returns the cached transcript when the
+    same audio has been transcribed before, skipping the recognizer entirely.
+    """
+    @functools.wraps(func)
+    def wrapper(source, sample_rate=16000):
+        digest = _hash_audio(source, sample_rate)
+        try:
+            transcript = _read_cached_transcript(digest)
+        except FileNotFoundError:
+            transcript_cache_stats['cache_miss'] += 1
+            transcript = func(source, sample_rate)
+            try:
+                _write_cached_transcript(digest, transcript)
+            except OSError as e:
+                # A cache failure must not throw away a computed transcript
+                log.warning("Could not cache transcript %s: %s", digest, e)
+        else:
+            transcript_cache_stats['cache_hit'] += 1
+        return transcript
+    return wrapper
+
+
+def _to_pcm16(samples):
+    """Mono int16 PCM bytes from an int16 array or float samples in [-1, 1]."""
+    samples = samples.reshape(-1)
+    if samples.dtype != np.int16:
+        samples = np.rint(np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+    return samples.tobytes()
+
+
+@cache_transcripts
+def transcribe_audio_file(source, sample_rate=16000):
     """
     Fast offline transcription using Vosk.
+    source is either a WAV path or an in-memory mono sample array at
+    sample_rate, which skips re-reading and decoding a file just written.
     Returns the recognized transcript string.
     """
-    wf = wave.open(wav_path, 'rb')
-    rec = KaldiRecognizer(VOSK_MODEL, wf.getframerate())
+    if isinstance(source, np.ndarray):
+        pcm = _to_pcm16(source)
+        step = FRAMES_PER_CHUNK * 2
+        transcript = _recognize((pcm[i:i + step] for i in range(0, len(pcm), step)), sample_rate)
+    else:
+        with wave.open(source, 'rb') as wf:
+            sr = wf.getframerate()
+            transcript = _recognize(iter(lambda: wf.readframes(FRAMES_PER_CHUNK), b''), sr)
+    log.debug("Transcript: %s", transcript)
+    return transcript
+
+
+def _recognize(chunks, sample_rate):
+    """Run 16-bit mono PCM byte chunks through a fresh recognizer and return the text."""
+    rec = KaldiRecognizer(_get_vosk_model(), sample_rate)
+    # Keep result JSON minimal: no word timings, partial words or n-best lists
     rec.SetWords(False)
+    rec.SetPartialWords(False)
+    rec.SetMaxAlternatives(0)
 
-    transcript = ''
-    while True:
-        data = wf.readframes(4000)
-        if len(data) == 0:
-            break
+    parts = []
+    for data in chunks:
         if rec.AcceptWaveform(data):
-            res = json.loads(rec.Result())
-            transcript += ' ' + res.get('text', '')
-    final_res = json.loads(rec.FinalResult())
-    transcript += ' ' + final_res.get('text', '')
-    transcript = transcript.strip()
-    print(f"Transcript: {transcript}\n")
-    return transcript
+            parts.append(orjson.loads(rec.Result())['text'])
+    parts.append(orjson.loads(rec.FinalResult())['text'])
+    return ' '.join(p for p in parts if p).strip()
+
+
+def transcribe_audio_files(paths, max_workers=None):
+    """
+    Transcribe several WAV files concurrently and return {path: transcript}.
+    Each worker runs its own KaldiRecognizer over the shared model; Vosk
+    decodes with the GIL released, so threads scale across cores without
+    loading a copy of the model per process. Defaults to one worker per core.
+    """
+    paths = list(dict.fromkeys(paths))
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(paths)))
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        return dict(zip(paths, ex.map(transcribe_audio_file, paths)))
+
+
+def warm_up_transcriber():
+    """
+    Run one second of silence through a recognizer so the first real
+    transcription does not pay for decoder graph and feature pipeline setup.
+    """
+    rec = KaldiRecognizer(_get_vosk_model(), 16000)
+    rec.AcceptWaveform(bytes(2 * 16000))
+    rec.FinalResult()
+
+
+def _paragraph_xml(text, style_id=None):
+    """
+    Serialized <w:p> for text in the given paragraph style. Tabs become <w:tab/>
+    and newlines/carriage returns <w:br/>, matching what add_paragraph writes.
+    """
+    ppr = f'<w:pPr><w:pStyle w:val="{style_id}"/></w:pPr>' if style_id else ''
+    if not text:
+        return f'<w:p>{ppr}</w:p>'
+    parts = []
+    for piece in _RUN_BREAKS.split(text):
+        if piece == '\t':
+            parts.append('<w:tab/>')
+        elif piece in ('\n', '\r'):
+            parts.append('<w:br/>')
+        elif piece:
+            parts.append(f'<w:t xml:space="preserve">{escape(piece)}</w:t>')
+    return f'<w:p>{ppr}<w:r>{"".join(parts)}</w:r></w:p>'
+
+
+def _format_note(note):
+    if isinstance(note, dict):
+        ts = datetime.datetime.fromtimestamp(note['noted_at_ns'] / 1e9).isoformat(timespec='seconds')
+        return f"{note['text']} (noted at {ts})"
+    return str(note)
+
+
+def _template_bytes():
+    """Read the report template on first use and keep the bytes for later reports."""
+    global _TEMPLATE_BYTES
+    if _TEMPLATE_BYTES is None:
+        with open(TEMPLATE_PATH, 'rb') as f:
+            _TEMPLATE_BYTES = f.read()
+    return _TEMPLATE_BYTES
 
 
 def generate_docx_report(session_data):
@@ -71,21 +393,15 @@ def generate_docx_report(session_data):
     session_data fields:
       - patient_name, patient_dob, diagnostic_category, started_at
       - questions: flat list of {question_id, question_text, transcript, typed_answer}
-      - general_notes: list of strings
+      - general_notes: list of {text, noted_at_ns} (time.time_ns() stamps) or plain strings
     """
-    reports_folder = os.path.join(os.path.dirname(__file__), 'reports')
-    os.makedirs(reports_folder, exist_ok=True)
-
     safe_name = session_data['patient_name'].replace(' ', '_')
-    timestamp = session_data['started_at'].replace(':', '').replace('-', '')
+    timestamp = session_data['started_at'].translate(STRIP_SEPARATORS)
     filename = f"{safe_name}_{timestamp}.docx"
-    full_path = os.path.join(reports_folder, filename)
+    full_path = os.path.join(REPORTS_FOLDER, filename)
 
-    template_path = os.path.join(
-        os.path.dirname(__file__), 'templates', 'report_template.docx'
-    )
-    if os.path.exists(template_path):
-        doc = Document(template_path)
+    if _TEMPLATE_EXISTS:
+        doc = Document(io.BytesIO(_template_bytes()))
     else:
         doc = Document()
 
@@ -99,26 +415,44 @@ def generate_docx_report(session_data):
 
     # Q&A
     doc.add_heading('Questions & Answers', level=1)
+    # Resolve style names to ids once; templates saved by a localized Word may
+    # not use the English ids
+    heading_style = doc.styles['Heading 2'].style_id
+    quote_style = doc.styles['Intense Quote'].style_id
+    fragments = []
     for item in session_data['questions']:
         qtext = item.get('question_text', '')
         transcript = item.get('transcript', '') or '(no recording/transcript)'
         typed = item.get('typed_answer', '') or '(no typed notes)'
 
-        doc.add_heading(f"Q: {qtext}", level=2)
-        doc.add_paragraph('Transcript:')
-        doc.add_paragraph(transcript, style='Intense Quote')
-        doc.add_paragraph('Typed Notes/Corrections:')
-        doc.add_paragraph(typed)
-        doc.add_paragraph('')
+        fragments.append(_paragraph_xml(f"Q: {qtext}", heading_style))
+        fragments.append(_paragraph_xml('Transcript:'))
+        fragments.append(_paragraph_xml(transcript, quote_style))
+        fragments.append(_paragraph_xml('Typed Notes/Corrections:'))
+        fragments.append(_paragraph_xml(typed))
+        fragments.append(_paragraph_xml(''))
+
+    # Serialize every Q&A paragraph, parse the lot once and splice it into the
+    # body, instead of one add_paragraph/add_heading tree mutation per line
+    body = doc.element.body
+    anchor = body.sectPr
+    insert = anchor.addprevious if anchor is not None else body.append
+    parsed = parse_xml(f'<w:body {nsdecls("w")}>{"".join(fragments)}</w:body>')
+    for p in list(parsed):
+        insert(p)
 
     # General notes
     doc.add_heading('General Notes', level=1)
     if session_data.get('general_notes'):
         for note in session_data['general_notes']:
-            doc.add_paragraph(str(note))
+            doc.add_paragraph(_format_note(note))
     else:
         doc.add_paragraph('(none)')
 
-    doc.save(full_path)
-    print(f"Report saved to: {full_path}")
+    # Serialize the zip in memory and hand it to the OS in a single write
+    buf = io.BytesIO()
+    doc.save(buf)
+    with open(full_path, 'wb') as f:
+        f.write(buf.getbuffer())
+    log.info("Report saved to: %s", full_path)
     return full_path
\ No newline at end of file